@@ -2,28 +2,24 @@
 
 from __future__ import unicode_literals
 import glob
-from htrc_features import FeatureReader
-from generic_processor import generic_processor 
-from six import iteritems, PY2, PY3 
+from generic_processor import generic_processor, create_volume
 import logging
-import bz2
 
-def get_term_volume_counts(args):
-        fr, path = args
-        vol = fr.create_volume(path)
+def get_term_volume_counts(path):
+        vol = create_volume(path)
 
         metadata = (vol.id, vol.year)
-        results = vol.term_volume_freqs()
+        results = vol.term_volume_freqs(pos=False).set_index('token')['count']
         return (metadata, results)
 
-def process_results(results, file):
+def process_results(results, out):
         for vol, result in results:
-            for t,c in iteritems(result):
-                s = "{0}\t{1}\t{2}\t{3}\n".format(vol[0], vol[1],t,c)
-                if PY2:
-                    file.write(s.encode('UTF-8'))
-                if PY3:
-                    file.write(str(s).encode('UTF-8'))
+            # One string per volume, rather than a format and write per term.
+            # Iterating plain lists avoids boxing each count as a numpy scalar.
+            prefix = "{0}\t{1}\t".format(vol[0], vol[1])
+            rows = zip(result.index.tolist(), result.tolist())
+            out.write("".join([prefix + t + "\t" + str(c) + "\n"
+                               for t, c in rows]).encode('UTF-8'))
 
 
 def main():
@@ -31,7 +27,7 @@ def main():
     logging.basicConfig(#filename='features.log',
             format='%(asctime)s:%(levelname)s:%(message)s',
             level=logging.DEBUG)
-    generic_processor(get_term_volume_counts, process_results, paths, 'term-volume-counts.txt.bz2')
+    generic_processor(get_term_volume_counts, process_results, paths, 'term-volume-counts.txt.gz')
 
 
 if __name__ == '__main__':
@@ -2,57 +2,83 @@
 
 from __future__ import unicode_literals
 import glob
-from htrc_features import FeatureReader
-from generic_processor import generic_processor 
-from six import iteritems, PY2, PY3
-from six.moves import map
+from generic_processor import generic_processor, create_volume
 import logging
-import bz2
+import numpy as np
 
-def char_counts_by_tenth(args):
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def page_counts(line_chars, page_count):
+        ''' Pivot a line_chars DataFrame to one column of per-page counts
+        for each character. '''
+        return line_chars['count'].groupby(level=['page', 'char']).sum()\
+                                  .unstack('char', fill_value=0)\
+                                  .reindex(range(1, page_count + 1), fill_value=0)
+
+def _range_sums(counts, limits):
+        out = np.zeros(len(limits) - 1, dtype=np.int64)
+        for k in range(len(limits) - 1):
+            s = 0
+            for j in range(limits[k], limits[k+1]):
+                s += counts[j]
+            out[k] = s
+        return out
+
+if njit is not None:
+    # Compiled once, and cached to disk between runs.
+    _range_sums = njit(cache=True)(_range_sums)
+
+def tenth_sums(counts, limits):
+        ''' Sum per-page counts within each range of pages in limits, an int64
+        array of range boundaries. '''
+        counts = np.asarray(counts, dtype=np.int64)
+        if njit is not None:
+            return _range_sums(counts, limits).tolist()
+        return np.add.reduceat(counts, limits[:-1]).tolist()
+
+def char_counts_by_tenth(path):
         # Initialize volume
-        fr, path = args
-        vol = fr.create_volume(path)
+        vol = create_volume(path)
         if not vol:
             return
 
-        if vol.pageCount < 10:
+        page_count = vol.page_count
+        if page_count < 10:
             logging.debug("Returning false due to short volume %s" % vol.id)
             return
-        # Determine ranges of pages for spliting into tenths of a page
-        size = float(vol.pageCount) // 10
-        limits = [int(round(size*val)) for val in range(0,10)] + [vol.pageCount]
-        # Create range tuples
-        ranges = [(limits[i], limits[i+1]) for i in range(0, len(limits)-1)]
-       
+        # Determine ranges of pages for spliting into tenths of a page,
+        # once per volume
+        size = page_count // 10
+        limits = np.append(np.arange(10, dtype=np.int64) * size, page_count)
+
         # Get each chars occurrance at start and end of line by page and
         # sum pages within the ranges
         result_list = []
+        begin_chars = page_counts(vol.begin_line_chars(), page_count)
+        end_chars = page_counts(vol.end_line_chars(), page_count)
+
+        for (char, counts) in begin_chars.items():
+            result_list += [('begin', char, tenth_sums(counts, limits))]
 
-        sum_ranges = lambda x, y : sum(counts[x:y])
-        for (char, counts) in iteritems(vol.begin_line_chars()):
-            tenth_counts = map(sum_ranges, ranges)
-            result_list += [('begin', char, tenth_counts)]
-        
-        for (char, counts) in iteritems(vol.end_line_chars()):
-            tenth_counts = map(sum_ranges, ranges)
-            result_list += [('end', char, tenth_counts)]
+        for (char, counts) in end_chars.items():
+            result_list += [('end', char, tenth_sums(counts, limits))]
         return (vol.id, result_list)
 
 
-def process_results(results, csvwriter):
+def process_results(results, out):
         for result in results:
             if not result:
                 continue
             vol, result_list = result
+            lines = []
             for place, char, counts in result_list:
                 assert(len(counts)==10)
                 l = [vol, place, char] + counts
-                if PY2:
-                #    file.write(s.encode('UTF-8'))
-                    csvwriter.writerow([s.encode('UTF-8') for s in l])
-                if PY3:
-                    csvwriter.writerow([str(s).encode('UTF-8') for s in l])
+                lines.append(b"\t".join([str(s).encode('UTF-8') for s in l]) + b"\n")
+            out.write(b"".join(lines))
 
 
 def main():
@@ -60,7 +86,7 @@ def main():
     logging.basicConfig(#filename='features.log',
             format='%(asctime)s:%(levelname)s:%(message)s',
             level=logging.DEBUG)
-    generic_processor(char_counts_by_tenth, process_results, paths)
+    generic_processor(char_counts_by_tenth, process_results, paths, 'chars-by-volume-part.tsv.bz2')
 
 
 if __name__ == '__main__':
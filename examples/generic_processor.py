@@ -0,0 +1,266 @@
+''' Shared batch driver for the example scripts in this directory.
+
+Runs a map function over volume paths in parallel, batch by batch, and hands
+the results to a result function that writes them to a compressed sink.
+'''
+
+from __future__ import unicode_literals
+import bz2
+import io
+import logging
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from htrc_features import Volume, resolvers
+
+# Set once per worker process by _init_worker.
+_volume_kwargs = {}
+
+
+CODEC_SUFFIXES = {'.bz2': 'bz2', '.gz': 'gz', '.zst': 'zstd'}
+
+
+class CompressedWriter(object):
+    ''' A write-only bytes sink that compresses its contents.
+
+    Writes are collected in memory and handed to the compressor in chunks of
+    at least flush_size bytes (or when `flush` is called), rather than one
+    tiny chunk per row. Compression and writing happen in a background
+    thread, fed through a bounded queue, so they overlap with producing the
+    next results.
+
+    codec: 'bz2', 'gz', or 'zstd' (requires the `zstandard` package). By
+        default, it is inferred from the suffix of outpath. gz and zstd are
+        several times faster than bz2 to write and to read back.
+    threads: for bz2, the number of chunks to compress in parallel. Each
+        chunk is written as an independent bz2 stream, as pbzip2 does; the
+        concatenated streams are read back as one file by bzip2 and by
+        Python's bz2 module. Defaults to the number of cores.
+    '''
+
+    def __init__(self, outpath, codec='default', buffer_size=1 << 20,
+                 flush_size=1 << 20, queue_size=8, threads=None):
+        if codec == 'default':
+            codec = CODEC_SUFFIXES.get(os.path.splitext(outpath)[1], 'bz2')
+
+        if threads is None:
+            threads = os.cpu_count() or 1
+        self.executor = None
+
+        if codec == 'bz2' and threads > 1:
+            self.compressor = None
+            self.executor = ThreadPoolExecutor(threads)
+            queue_size = max(queue_size, 2 * threads)
+        elif codec == 'bz2':
+            self.compressor = bz2.BZ2Compressor(6)
+        elif codec == 'gz':
+            # wbits=31 writes a gzip header and trailer
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif codec == 'zstd':
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor(level=10, threads=-1)\
+                                       .compressobj()
+        else:
+            raise ValueError("Unknown codec: {}".format(codec))
+
+        self.raw = io.BufferedWriter(io.FileIO(outpath, 'w'), buffer_size)
+        self.pending = []
+        self.pending_size = 0
+        self.flush_size = flush_size
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _write_loop(self):
+        # The compressors release the GIL, so this runs alongside the
+        # main thread.
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is not None:
+                # Keep draining the queue after a failure, so that put() in
+                # the main thread never blocks on a full queue.
+                continue
+            try:
+                if self.executor:
+                    # A future; the queue keeps the streams in order.
+                    self.raw.write(data.result())
+                else:
+                    self.raw.write(self.compressor.compress(data))
+            except BaseException as e:
+                self.error = e
+
+    def _raise_error(self):
+        ''' Re-raise an exception from the writer thread in the caller. '''
+        if self.error is not None:
+            raise self.error
+
+    def write(self, s):
+        self.pending.append(s)
+        self.pending_size += len(s)
+        if self.pending_size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        self._raise_error()
+        if self.pending:
+            data = b"".join(self.pending)
+            if self.executor:
+                data = self.executor.submit(bz2.compress, data, 6)
+            self.queue.put(data)
+            self.pending = []
+            self.pending_size = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.writer.join()
+            if self.executor:
+                self.executor.shutdown()
+        try:
+            self._raise_error()
+            if not self.executor:
+                self.raw.write(self.compressor.flush())
+        finally:
+            self.raw.close()
+
+
+class Pbzip2Resolver(resolvers.IdResolver):
+    ''' A path resolver that decompresses bz2 files with pbzip2, which decodes
+    the independent blocks of a file in parallel. The parser receives
+    already-decompressed JSON.
+    '''
+
+    def __init__(self, threads=None, format='json', **kwargs):
+        self.threads = threads
+        kwargs['compression'] = None
+        super().__init__(format=format, **kwargs)
+
+    def _open(self, id, mode='rb', **kwargs):
+        if mode != 'rb':
+            raise NotImplementedError("pbzip2 resolution is read-only")
+        cmd = ['pbzip2', '-dc']
+        if self.threads:
+            cmd.append('-p{}'.format(self.threads))
+        proc = subprocess.Popen(cmd + [id], stdout=subprocess.PIPE)
+        data, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise IOError("pbzip2 failed to decompress {}".format(id))
+        return io.BytesIO(data)
+
+
+def _prefetch(paths):
+    ''' Ask the OS to start reading paths into the page cache, so that the
+    workers' reads of the next batch hit memory rather than disk. '''
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def _init_worker(volume_kwargs):
+    global _volume_kwargs
+    _volume_kwargs = volume_kwargs
+
+
+def create_volume(path):
+    ''' Create a Volume inside a worker, with the volume_kwargs that were
+    passed to generic_processor. '''
+    return Volume(path, **_volume_kwargs)
+
+
+def _process_batches(pool, map_func, result_func, paths, f, batch_size,
+                     ncpus, prefetch):
+    n = 0
+    m = (len(paths) + batch_size - 1) // batch_size
+
+    logging.info("Starting processing")
+    # Slice batches by offset, rather than re-slicing the remaining paths,
+    # which copies the whole list every batch.
+    for i in range(0, len(paths), batch_size):
+        start = time.time()
+        batch = paths[i:i + batch_size]
+        n += 1
+        logging.info("Starting batch {0}/{1}".format(n, m))
+        next_batch = paths[i + batch_size:i + 2 * batch_size]
+        if prefetch and next_batch:
+            threading.Thread(target=_prefetch, args=(next_batch,),
+                             daemon=True).start()
+        # Hand results to result_func as they arrive, rather than holding the
+        # whole batch until the slowest volume finishes.
+        chunksize = max(1, len(batch) // (4 * ncpus))
+        results = pool.imap_unordered(map_func, batch, chunksize=chunksize)
+        result_func(results, f)
+
+        if f:
+            f.flush()
+        logging.info("Batch of {0} volumes finished in {1}s".format(
+                     len(batch), time.time() - start))
+
+
+def generic_processor(map_func, result_func, paths, outpath=None,
+                      batch_size=1000, decompress_threads=None,
+                      prefetch=True, codec='default', **volume_kwargs):
+    '''
+    map_func: called in a worker process with a path. Use create_volume(path)
+        to load it.
+    result_func: called with an iterator over map_func results for a batch,
+        in completion order, and a bytes sink for the output. Write whole
+        volumes of encoded tab-separated rows at a time to it, not single
+        rows.
+    decompress_threads: if set, and pbzip2 is installed, decompress each
+        .json.bz2 input with this many pbzip2 threads. Useful when there are
+        fewer volumes in flight than cores.
+    codec: compression for outpath. See CompressedWriter.
+    prefetch: while a batch is processed, read ahead the files of the next
+        batch in a background thread. Only on platforms with posix_fadvise.
+    volume_kwargs: arguments for the Volumes made by create_volume. These are
+        sent to each worker once, rather than with every task.
+    '''
+    if decompress_threads:
+        if shutil.which('pbzip2'):
+            volume_kwargs['id_resolver'] = Pbzip2Resolver(threads=decompress_threads)
+        else:
+            logging.warning("pbzip2 not found; falling back to single-threaded bz2")
+
+    f = CompressedWriter(outpath, codec=codec) if outpath else None
+    prefetch = prefetch and hasattr(os, 'posix_fadvise')
+
+    ncpus = mp.cpu_count()
+    try:
+        # One pool for the whole run; starting workers is the costly part.
+        pool = mp.Pool(ncpus, initializer=_init_worker,
+                       initargs=(volume_kwargs,))
+        try:
+            _process_batches(pool, map_func, result_func, paths, f,
+                             batch_size, ncpus, prefetch)
+        except BaseException:
+            # Don't wait for the rest of the batch; stop the workers.
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+    finally:
+        # Always finish the compressed stream, so the output isn't truncated.
+        if f:
+            f.close()
+    logging.info("Done")
@@ -1,11 +1,16 @@
 from __future__ import unicode_literals
 
+import collections
+import functools
+import itertools
 import logging
+import os
+import numpy as np
 import pandas as pd
-import pymarc
-from six import StringIO
+from io import BytesIO
 import warnings
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from htrc_features import parsers, resolvers, transformations
 from htrc_features.parsers import MissingDataError, SECREF
@@ -14,16 +19,206 @@ try:
     import rapidjson as json
 except ImportError:
     import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
     
 import requests
 
+# Shared across volumes, so repeated Bibliographic API lookups reuse the
+# same pooled connection.
+_http_session = requests.Session()
+
 
 
 class MissingFieldError(Exception):
     pass
 
+def _sum_counts(df, groups):
+    '''
+    Sum the 'count' column of df by the index levels and/or columns named in
+    groups. Equivalent to df.reset_index().groupby(groups).sum()[['count']],
+    but each key is reduced to integer codes (reusing the MultiIndex codes
+    where possible) and combined into one composite key, so the sum is a
+    single np.bincount pass rather than a hash groupby over strings.
+    '''
+    codes, levels = [], []
+    for name in groups:
+        if isinstance(df.index, pd.MultiIndex) and name in df.index.names:
+            i = df.index.names.index(name)
+            level_codes, level = df.index.codes[i], df.index.levels[i]
+        elif name in df.index.names:
+            level_codes, level = pd.factorize(df.index, sort=True)
+        elif isinstance(df[name].dtype, pd.CategoricalDtype) and \
+                df[name].cat.categories.is_monotonic_increasing:
+            level_codes, level = df[name].cat.codes, df[name].cat.categories
+        else:
+            level_codes, level = pd.factorize(df[name], sort=True)
+        level_codes = np.asarray(level_codes, dtype=np.int64)
+        if not isinstance(level, pd.Index):
+            # Levels of an existing index are kept as they are, so that
+            # their cached is_monotonic_increasing is reused.
+            level = pd.Index(level)
+        if not level.is_monotonic_increasing:
+            # Renumber the codes so that they sort like the values
+            order = level.argsort()
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            level_codes = np.where(level_codes < 0, -1, rank[level_codes])
+            level = level.take(order)
+        codes.append(level_codes)
+        levels.append(level)
+
+    # Missing keys (code -1) are dropped, as in groupby
+    valid = np.logical_and.reduce([c >= 0 for c in codes])
+    counts = df['count'].to_numpy()
+    if not valid.all():
+        codes = [c[valid] for c in codes]
+        counts = counts[valid]
+
+    # Combine the codes in order, so that the composite key sorts the same
+    # way as the tuple of values. If the key space would overflow, re-number
+    # it densely first, which preserves that order.
+    key, size = codes[0], len(levels[0])
+    for c, level in zip(codes[1:], levels[1:]):
+        if size * len(level) >= 2**62:
+            key = np.unique(key, return_inverse=True)[1]
+            size = key.max() + 1
+        key = key * len(level) + c
+        size *= len(level)
+
+    if len(key) and (key[1:] >= key[:-1]).all():
+        # Already sorted by the groups, e.g. when they are a leading subset of
+        # a lexsorted index: sum each run of equal keys, without sorting.
+        first = np.flatnonzero(np.diff(key)) + 1
+        first = np.concatenate([[0], first])
+        sums = np.add.reduceat(counts, first, dtype=np.int64)
+    else:
+        uniq, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+        sums = np.bincount(inverse, weights=counts, minlength=len(uniq))
+
+    codes = [c[first] for c in codes]
+    if len(groups) == 1:
+        index = levels[0].take(codes[0]).rename(groups[0])
+    else:
+        # Drop unused level values. Unlike MultiIndex.remove_unused_levels,
+        # this keeps the levels sorted.
+        for i, (c, level) in enumerate(zip(codes, levels)):
+            used = np.zeros(len(level), dtype=bool)
+            used[c] = True
+            if not used.all():
+                codes[i] = (np.cumsum(used) - 1)[c]
+                levels[i] = level[used]
+        index = pd.MultiIndex(levels=levels, codes=codes, names=groups,
+                              verify_integrity=False)
+    return pd.DataFrame({'count': sums.astype(counts.dtype)}, index=index)
+
+def _factorize_lower(level):
+    '''
+    Return sorted (codes, uniques) for the lowercased values of an Index of
+    strings. With pyarrow installed, lowercasing, deduplication and sorting
+    run in Arrow kernels, and only the unique lowercased strings become
+    Python objects. Non-ASCII strings are lowercased by Python, so that
+    results match str.lower exactly.
+    '''
+    if pa is None:
+        return pd.factorize(level.str.lower(), sort=True)
+    try:
+        arr = pa.array(np.asarray(level), type=pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pd.factorize(level.str.lower(), sort=True)
+
+    lowered = pc.utf8_lower(arr)
+    non_ascii = np.asarray(pc.invert(pc.string_is_ascii(arr)))
+    if non_ascii.any():
+        python_lowered = np.asarray(level[non_ascii].str.lower())
+        lowered = pc.replace_with_mask(lowered, pa.array(non_ascii),
+                                       pa.array(python_lowered, type=pa.string()))
+
+    # UTF-8 byte order is code point order, as for Python strings
+    encoded = pc.dictionary_encode(lowered)
+    order = np.asarray(pc.array_sort_indices(encoded.dictionary))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    codes = rank[np.asarray(encoded.indices)]
+    uniques = encoded.dictionary.take(pa.array(order)).to_numpy(zero_copy_only=False)
+    return codes, pd.Index(uniques)
+
+def _lowercase(df, codes_cache=None):
+    '''
+    Return the lowercased tokens of df. For a MultiIndex, only the unique
+    tokens of the level are lowercased, giving a Categorical with sorted
+    categories. The factorization of that level is kept in codes_cache, if
+    provided, and reused while the level is unchanged.
+    '''
+    if not isinstance(df.index, pd.MultiIndex):
+        return df.index.get_level_values('token').str.lower()
+
+    i = df.index.names.index('token')
+    level = df.index.levels[i]
+    cached = codes_cache.get('lowercase') if codes_cache is not None else None
+    if cached is None or not (cached[0] is level or cached[0].equals(level)):
+        mapping, uniques = _factorize_lower(level)
+        cached = (level, mapping, uniques)
+        if codes_cache is not None:
+            codes_cache['lowercase'] = cached
+    _, mapping, uniques = cached
+
+    token_codes = df.index.codes[i]
+    codes = np.where(token_codes < 0, -1, mapping[token_codes])
+    return pd.Categorical.from_codes(codes, categories=uniques)
+
+def _level_code(level, value):
+    ''' Return the code of value in an index level, or -1 if missing. '''
+    try:
+        return level.get_loc(value)
+    except KeyError:
+        return -1
+
+def _page_rows(df, page, level='page', bounds_cache=None):
+    '''
+    Return the rows of df for one page, like
+    df.xs(page, level=level, drop_level=False), raising a KeyError if the
+    page is missing. When the page codes are sorted, as in the internal
+    frames of a Volume, each page's rows are a contiguous range. The range
+    boundaries for all pages are found once, with a binary search, and
+    kept in bounds_cache.
+    '''
+    index = df.index
+    if not isinstance(index, pd.MultiIndex):
+        return df.loc[[page]]
+
+    i = index.names.index(level)
+    code = _level_code(index.levels[i], page)
+    if code < 0:
+        raise KeyError(page)
+
+    cached = bounds_cache.get(level) if bounds_cache is not None else None
+    if cached is None or cached[0] is not index:
+        codes = index.codes[i]
+        starts = None
+        if (codes[1:] >= codes[:-1]).all():
+            starts = np.searchsorted(codes, np.arange(len(index.levels[i]) + 1))
+        cached = (index, starts)
+        if bounds_cache is not None:
+            bounds_cache[level] = cached
+    starts = cached[1]
+
+    if starts is None:
+        rows = np.flatnonzero(index.codes[i] == code)
+        if len(rows) == 0:
+            raise KeyError(page)
+        return df.take(rows)
+    if starts[code] == starts[code + 1]:
+        raise KeyError(page)
+    return df.iloc[starts[code]:starts[code + 1]]
+
 def group_tokenlist(in_df, pages=True, section='all', case=True, pos=True,
-                    page_freq=False, pagecolname='page', indexed = True):
+                    page_freq=False, pagecolname='page', indexed = True,
+                    codes_cache=None):
     
     '''
         Return a token count dataframe with requested folding.
@@ -39,6 +234,8 @@ def group_tokenlist(in_df, pages=True, section='all', case=True, pos=True,
         on a page. Defaults to false.
         pagecolname[string]: Name of the page column. Only used if treating
             a different column like pages (e.g. chunks)
+        codes_cache[dict]: Optional store for factorizations of in_df that
+            can be reused between calls, such as Volume._codes_cache.
     '''
     groups = []
     if pages:
@@ -66,14 +263,17 @@ def group_tokenlist(in_df, pages=True, section='all', case=True, pos=True,
     if section in ['all', 'group', 'ignore']:
         df = in_df
     elif section in SECREF:
-        idx = pd.IndexSlice
-        try:
-            df = in_df.loc[idx[:, section, :, :], ]
-        except KeyError:
+        # Select on the integer codes of the section level, rather than
+        # slicing by label.
+        i = in_df.index.names.index('section')
+        section_code = _level_code(in_df.index.levels[i], section)
+        if section_code < 0:
             logging.debug("Section {} not available".format(section))
             df = pd.DataFrame([], columns=groups+['count'])\
                    .set_index(groups)
             return df
+        # take() avoids the index comparison done by boolean indexing
+        df = in_df.take(np.flatnonzero(in_df.index.codes[i] == section_code))
     else:
         logging.error("Invalid section argument: {}".format(section))
         return
@@ -82,47 +282,67 @@ def group_tokenlist(in_df, pages=True, section='all', case=True, pos=True,
         # Replace our df reference to a copy.
         df = df.copy()
         logging.debug('Adding lowercase column')
-        df.insert(len(df.columns), 'lowercase',
-                  df.index.get_level_values('token').str.lower())
+        df.insert(len(df.columns), 'lowercase', _lowercase(df, codes_cache))
     elif case:
         assert 'token' in in_df.index.names
 
     # Check if we need to group anything
     if groups == in_df.index.names:
         if page_freq:
-            pd.options.mode.chained_assignment = None
-            df['count'] = 1
-            pd.options.mode.chained_assignment = 'warn'
+            # in_df may be the Volume's internal tokenlist, so don't edit it
+            # in place.
+            df = df.assign(count=1)
         return df
     else:
         if not page_freq:
-            return df.reset_index().groupby(groups).sum(numeric_only=True)[['count']]
-        elif page_freq and 'page' in groups:
-            df = df.reset_index().groupby(groups).sum(numeric_only=True)[['count']]
-            pd.options.mode.chained_assignment = None
-            df['count'] = 1
-            pd.options.mode.chained_assignment = 'warn'
-            return df
-        elif page_freq and 'page' not in groups:
-            # We'll have to group page-level, then group again
-            def set_to_one(x):
-                x['count'] = 1
-                return x
-            return df.reset_index().groupby([pagecolname]+groups).apply(set_to_one)\
-                     .groupby(groups).sum(numeric_only=True)[['count']]
+            return _sum_counts(df, groups)
+        elif page_freq and pagecolname in groups:
+            return _sum_counts(df, groups).assign(count=1)
+        elif page_freq and pagecolname not in groups:
+            # We'll have to group page-level, then group again: each
+            # page a group occurs on counts once.
+            df = _sum_counts(df, [pagecolname]+groups).assign(count=1)
+            return _sum_counts(df, groups)
 
 def fold_pages(page_list, chunkname):
     '''
     Fold the tokenlist from a provided list of page tokenlists,
     replacing the page with a named 'chunk'
     '''
-    chunk = pd.concat(page_list, sort=False)
-    indexnames = chunk.index.names
-    newindex = [v if v != 'page' else 'chunk'  for v in indexnames]
-    
-    chunk['chunk'] = chunkname
-    grouped = chunk.reset_index().groupby(newindex)[['count']].sum()
-    return grouped
+    if len(page_list) == 0:
+        raise ValueError("No page tokenlists to fold")
+
+    # The pages share an index schema, so stack the index codes of each
+    # level, rather than concatenating the frames row by row.
+    indexes = [df.index if isinstance(df.index, pd.MultiIndex)
+               else pd.MultiIndex.from_arrays([df.index]) for df in page_list]
+    indexnames = indexes[0].names
+    newindex = [v if v != 'page' else 'chunk' for v in indexnames]
+    nrows = sum(len(index) for index in indexes)
+
+    levels, codes = [], []
+    for i, name in enumerate(indexnames):
+        if name == 'page':
+            levels.append(pd.Index([chunkname]))
+            codes.append(np.zeros(nrows, dtype=np.int64))
+            continue
+        page_levels = [index.levels[i] for index in indexes]
+        page_codes = [index.codes[i] for index in indexes]
+        level = page_levels[0]
+        if all(l is level or l.equals(level) for l in page_levels[1:]):
+            codes.append(np.concatenate(page_codes))
+        else:
+            # Map each page's codes onto the union of the levels
+            level = level.append(page_levels[1:]).unique().sort_values()
+            codes.append(np.concatenate([
+                np.where(c < 0, -1, level.get_indexer(l)[c])
+                for l, c in zip(page_levels, page_codes)]))
+        levels.append(level)
+
+    index = pd.MultiIndex(levels=levels, codes=codes, names=newindex,
+                          verify_integrity=False)
+    counts = np.concatenate([df['count'].to_numpy() for df in page_list])
+    return _sum_counts(pd.DataFrame({'count': counts}, index=index), newindex)
 
 def default_resolver(id, path, format, dir):
     if (id is None) or (path is not None):
@@ -140,37 +360,40 @@ def default_resolver(id, path, format, dir):
     
     raise AttributeError("No sensible default for format of {} with ids like {}".format(format, id))
 
+# Sections and places that are kept as index levels by group_linechars
+LINECHAR_SECTIONS = frozenset(SECREF + ['all'])
+LINECHAR_PLACES = frozenset(['begin', 'end', 'all'])
 
 def group_linechars(df, section='all', place='all'):
 
     # Set up grouping
     groups = ['page']
-    if section in SECREF + ['all']:
+    if section in LINECHAR_SECTIONS:
         groups.append('section')
-    if place in ['begin', 'end', 'all']:
+    if place in LINECHAR_PLACES:
         groups.append('place')
-    groups.append('character')
+    groups.append('char')
 
-    # Set up slicing
-    slices = [slice(None)]
-    if section in ['all', 'group']:
-        slices.append(slice(None))
-    elif section in SECREF:
-        slices.append([section])
+    # Select rows on the codes of the section and place levels
+    selections = []
+    if section in SECREF:
+        selections.append(('section', section))
     if place in ['begin', 'end']:
-        slices.append([place])
-    elif place in ['group', 'all']:
-        # It's hard to imagine a use for place='group', but adding for
-        # completion
-        slices.append(slice(None))
-
-    if slices != [slice(None)] * 3:
-            df = df.loc[tuple(slices), ]
-
-    if groups == ['page', 'section', 'place', 'character']:
+        selections.append(('place', place))
+
+    if selections:
+        mask = np.ones(len(df), dtype=bool)
+        for name, value in selections:
+            i = df.index.names.index(name)
+            code = _level_code(df.index.levels[i], value)
+            # A missing label selects nothing
+            mask &= (df.index.codes[i] == code) & (code >= 0)
+        df = df.take(np.flatnonzero(mask))
+
+    if groups == ['page', 'section', 'place', 'char']:
         return df
     else:
-        return df.groupby(groups).sum(numeric_only=True)[['count']]
+        return _sum_counts(df, groups)
 
 # CLASSES
 class FeatureReader(object):
@@ -220,11 +443,14 @@ class FeatureReader(object):
         
         self.ids = ids
 
-        if self.ids and type(self.ids) is not list:
+        if isinstance(self.ids, str) or not hasattr(self.ids, '__iter__'):
             logging.warning("You have passed a single items to 'ids'"
                             "or 'paths' in a FeatureReader initialization."
                             "Consider calling 'volume' directly.")
             self.ids = [self.ids]
+        elif not isinstance(self.ids, list):
+            # e.g. a tuple or generator of ids
+            self.ids = list(self.ids)
                             
         self.index = 0
         self.parser_kwargs = kwargs
@@ -237,15 +463,19 @@ class FeatureReader(object):
         return len(self.ids)
 
     def volumes(self):
-        ''' Generator for returning Volume objects '''
-        for id in self.ids:
-            vol = Volume(id=id, format = self.format,
-                         id_resolver=self.id_resolver, dir = self.dir,
-                         compression = self.compression,
-                         **self.parser_kwargs)
+        '''
+        Generator for returning Volume objects.
+
+        When volumes are fetched over HTTP, each one after the first is
+        downloaded in a background thread while the one before it is in use,
+        so the network wait overlaps with your processing.
+        '''
+        ids = iter(self.ids)
+        for id in ids:
+            vol = Volume(id=id, **self._volume_kwargs())
+            yield vol
             # Learn the resolver and formats from the Volume instance,
             # and keep what we've learned for all later volumes we make.
-            yield vol
             if self.format == 'default':
                 self.format = vol.id_resolver.format
             if self.id_resolver == 'default':
@@ -254,7 +484,140 @@ class FeatureReader(object):
                 self.compression = vol.id_resolver.compression
             if self.dir != vol.id_resolver.dir:
                 self.dir = vol.id_resolver.dir
-                
+            if self._uses_http():
+                break
+        else:
+            return
+
+        # Keep one volume downloading ahead of the one being yielded.
+        kwargs = self._volume_kwargs()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = None
+            for id in ids:
+                next_future = executor.submit(_load_volume, id, kwargs)
+                if future is not None:
+                    yield future.result()
+                future = next_future
+            if future is not None:
+                yield future.result()
+
+    def parallel_volumes(self, n_cpu=None, chunksize=4, window=None):
+        '''
+        Generator for returning Volume objects, loaded in parallel. Volumes
+        are yielded in the same order as volumes().
+
+        n_cpu: number of workers. Defaults to the number of cores.
+        chunksize: number of ids sent to a worker at a time.
+        window: the most chunks queued or loaded ahead of the one being
+            yielded. Defaults to four per worker. Loaded Volumes wait in
+            memory until they are yielded, so this bounds memory use.
+
+        Local files are loaded in a process pool, since decompressing and
+        parsing are CPU-bound. Remote files are loaded in a thread pool, since
+        the bottleneck is the network.
+        '''
+        return self._imap(None, n_cpu, chunksize, window)
+
+    def parallel_tokenlists(self, n_cpu=None, chunksize=4, **kwargs):
+        '''
+        Generator for returning each volume's tokenlist, computed in
+        parallel, in the same order as volumes(). Arguments other than n_cpu
+        and chunksize are passed to Volume.tokenlist; e.g. chunk=True for
+        chunked tokenlists, and htid=True to tell the volumes apart.
+
+        Like map(), only the tokenlists are sent back from the workers,
+        rather than the full Volumes of parallel_volumes.
+        '''
+        return self.map(functools.partial(Volume.tokenlist, **kwargs),
+                        n_cpu=n_cpu, chunksize=chunksize)
+
+    def map(self, func, n_cpu=None, chunksize=4, window=None):
+        '''
+        Generator for returning func(volume) for each volume, computed in
+        parallel, in the same order as volumes(). func must be picklable,
+        i.e. defined at the top level of a module, and only its return
+        values are sent back from the workers.
+
+        n_cpu: number of workers. Defaults to the number of cores.
+        chunksize: number of ids sent to a worker at a time.
+        window: the most chunks queued or computed ahead of the one being
+            yielded. Defaults to four per worker.
+        '''
+        return self._imap(func, n_cpu, chunksize, window)
+
+    def parallel_save(self, dir, format='parquet', token_kwargs="default",
+                      n_cpu=None, chunksize=4, **kwargs):
+        '''
+        Save every volume with Volume.save, in parallel; e.g. for converting
+        a collection of feature files to parquet. Other arguments are passed
+        to Volume.save.
+
+        n_cpu: number of workers. Defaults to the number of cores.
+        chunksize: number of ids sent to a worker at a time.
+
+        As in map(), each worker loads its volumes by id, so only ids and
+        arguments are sent between processes.
+        '''
+        save = functools.partial(Volume.save, dir=dir, format=format,
+                                 token_kwargs=token_kwargs, **kwargs)
+        for _ in self.map(save, n_cpu=n_cpu, chunksize=chunksize):
+            pass
+
+    def _imap(self, func, n_cpu, chunksize, window):
+        ''' Ordered, parallel func(volume) over the ids, for
+        parallel_volumes and map. Ids are submitted in chunks, with at most
+        `window` chunks in flight, rather than all at once as with
+        Executor.map; so a long id list doesn't pile up tasks or results
+        that the caller hasn't reached yet. '''
+        if window is None:
+            window = 4 * (n_cpu or os.cpu_count() or 1)
+        kwargs = self._volume_kwargs()
+        ids = iter(self.ids)
+        chunks = iter(lambda: list(itertools.islice(ids, chunksize)), [])
+        with self._executor(n_cpu) as executor:
+            pending = collections.deque(
+                executor.submit(_map_volumes, chunk, kwargs, func)
+                for chunk in itertools.islice(chunks, max(1, window)))
+            try:
+                while pending:
+                    results = pending.popleft().result()
+                    # Top the window back up before handing results out.
+                    for chunk in itertools.islice(chunks, 1):
+                        pending.append(executor.submit(_map_volumes, chunk,
+                                                       kwargs, func))
+                    for result in results:
+                        yield result
+            finally:
+                # If the caller stops early, don't run the rest.
+                for future in pending:
+                    future.cancel()
+
+    def _volume_kwargs(self):
+        ''' Arguments for loading each Volume, as in volumes(). '''
+        return dict(format=self.format, id_resolver=self.id_resolver,
+                    dir=self.dir, compression=self.compression,
+                    **self.parser_kwargs)
+
+    def _executor(self, n_cpu=None):
+        ''' The worker pool for parallel_volumes and map (and so for the
+        parallel tokenlist and save methods built on it). '''
+        if self._uses_http():
+            return ThreadPoolExecutor(max_workers=n_cpu)
+        return ProcessPoolExecutor(max_workers=n_cpu)
+
+    def _uses_http(self):
+        ''' Whether the volumes are fetched over HTTP. '''
+        resolver = self.id_resolver
+        if isinstance(resolver, resolvers.IdResolver):
+            return isinstance(resolver, resolvers.HttpResolver)
+        if resolver is None and self.ids:
+            format = "json" if self.format == "default" else self.format
+            try:
+                resolver = default_resolver(self.ids[0], None, format, self.dir)
+            except AttributeError:
+                return False
+        return isinstance(resolver, str) and resolver.endswith("http")
+
     def jsons(self, object = True, decompress = True):
         ''' 
 
@@ -297,13 +660,33 @@ class FeatureReader(object):
     def __str__(self):
         return "<%d path FeatureReader>" % (len(self.ids))
 
+def _load_volume(id, kwargs):
+    ''' Load a Volume in a worker, for the prefetching in
+    FeatureReader.volumes. '''
+    return Volume(id=id, **kwargs)
+
+def _map_volumes(ids, load_kwargs, func=None):
+    ''' Load a chunk of Volumes in a worker and apply func to each, for
+    FeatureReader.map. Without func, return the Volumes themselves, for
+    FeatureReader.parallel_volumes. '''
+    vols = (Volume(id=id, **load_kwargs) for id in ids)
+    if func is None:
+        return list(vols)
+    return [func(vol) for vol in vols]
+
+FILENAME_SUFFIXES = (".gz", ".bz2", ".json", ".parquet")
+
+# Chunking functions for each tokenlist(overflow_strategy=...)
+CHUNK_METHODS = {'ends': transformations.chunk_ends,
+                 'even': transformations.chunk_even,
+                 'last': transformations.chunk_last}
+
 def filename_or_id(string):
     """
     Determine based on suffix is something is a file or an ide.
     """
-    for ending in [".gz", ".bz2", ".json", ".parquet"]:
-        if string.endswith(ending):
-            return "filename"
+    if string.endswith(FILENAME_SUFFIXES):
+        return "filename"
     if "." in string[:6]:
         # All Hathi ids have dots in them.
         return "id"
@@ -375,6 +758,10 @@ class Volume(object):
         self._line_chars = pd.DataFrame()
         self._page_features = pd.DataFrame()
         self._section_features = pd.DataFrame()
+        self._feature_cache = {}
+        # Row ranges of each page in the internal frames; see _page_rows
+        self._page_bounds = dict(tokens={}, tokenlist={}, line_chars={}, line_char_groups={},
+                                 page={}, section={})
         self._extra_metadata = None
 
         if "resolver" in kwargs:
@@ -416,7 +803,7 @@ class Volume(object):
                 if id_resolver == 'http':
                     compression = None
                 elif format == 'parquet':
-                    compression = 'snappy'
+                    compression = parsers.PARQUET_COMPRESSION
                 elif format == 'json':
                     compression = "bz2"
 
@@ -454,6 +841,18 @@ class Volume(object):
         self.args = kwargs
         self._update_meta_attrs()
     
+    @property
+    def _tokencounts(self):
+        return self.__tokencounts
+
+    @_tokencounts.setter
+    def _tokencounts(self, df):
+        # Grouped tokenlists and factorizations are only valid for the
+        # internal representation they were computed from.
+        self.__tokencounts = df
+        self._tokencount_cache = {}
+        self._codes_cache = {}
+
     def _update_meta_attrs(self):
         ''' Takes metadata from the parser's id metadata variable and 
         assigns it to attributes in the Volume '''
@@ -477,27 +876,71 @@ class Volume(object):
         if self._page_features.empty:
             self._page_features = self.parser._make_page_feature_df()
             
-        return self._get_basic_feature(self._page_features, section='all', feature=feature, page_select=page_select)
+        return self._cached_basic_feature('page', self._page_features, section='all',
+                                          feature=feature, page_select=page_select)
     
     def section_features(self, feature='all', section='default', page_select=False):
         if self._section_features.empty:
             self._section_features = self.parser._make_section_feature_df()
-        return self._get_basic_feature(self._section_features, section=section, feature=feature, page_select=page_select)
+        return self._cached_basic_feature('section', self._section_features, section=section,
+                                          feature=feature, page_select=page_select)
 
-    def _get_basic_feature(self, df, feature='all', section='default', page_select=False):
+    def _cached_basic_feature(self, name, df, feature='all', section='default', page_select=False):
+        '''
+        _get_basic_feature, with the selections kept in _feature_cache. The
+        per-page accessors (e.g. Page.line_count) call this once per page,
+        often for the same feature.
+        '''
+        if section == 'default':
+            section = self.default_page_section
+        key = (name, tuple(feature) if isinstance(feature, list) else feature,
+               section, page_select)
+        if key not in self._feature_cache:
+            self._feature_cache[key] = self._get_basic_feature(df, feature=feature, section=section,
+                                                               page_select=page_select,
+                                                               bounds_cache=self._page_bounds[name])
+        return self._feature_cache[key].copy()
+
+    def _section_feature_at(self, feature, page, section='default'):
+        '''
+        A single page's value for a section feature. Looked up in the cached
+        selection for the whole volume, so that iterating over Pages does not
+        select and cache every page separately.
+        '''
+        if section == 'default':
+            section = self.default_page_section
+        key = ('section', feature, section, False)
+        if key not in self._feature_cache:
+            self.section_features(feature=feature, section=section)
+        values = self._feature_cache[key]
+        rows = values.to_numpy()[values.index.get_loc(page)]
+        if np.ndim(rows):
+            # With section='all', a page has a row per section: combine
+            # them into the page's value, like section='group' does.
+            return rows.max() if feature == 'capAlphaSeq' else rows.sum()
+        return rows
+
+    def _get_basic_feature(self, df, feature='all', section='default', page_select=False,
+                           bounds_cache=None):
         '''Selects a basic feature from a page_features or section_features dataframe'''
         
         if section == 'default':
             section = self.default_page_section
         
         if page_select:
-            df = df.xs(page_select, level='page', drop_level=False)
+            df = _page_rows(df, page_select, bounds_cache=bounds_cache)
         
         if feature is not 'all':
             df = df[feature]
 
         if section in ['header', 'body', 'footer']:
-            return df.xs(section, level='section')
+            # Select on the codes of the section level, rather than with xs
+            i = df.index.names.index('section')
+            section_code = _level_code(df.index.levels[i], section)
+            if section_code < 0:
+                raise KeyError(section)
+            return df.take(np.flatnonzero(df.index.codes[i] == section_code))\
+                     .droplevel('section')
         elif section == 'all':
             return df
         elif section == 'group':
@@ -542,14 +985,17 @@ class Volume(object):
         return: A `pymarc` record. See pymarc's documentation for details on using it.
         """
         if not self._extra_metadata:
+            # Only needed here, so pymarc isn't loaded with the package
+            import pymarc
             logging.debug("Looking up full metadata for {0}".format(self.id))
-            data = requests.get(self.ht_bib_url).json()
+            data = _http_session.get(self.ht_bib_url).json()
 
             record_id = data['items'][0]['fromRecord']
             marc = data['records'][record_id]['marc-xml']
 
-            # Pymarc only reads a file, so stream the text as if it was one
-            xml_stream = StringIO(marc)
+            # Pymarc only reads a file, so stream the encoded text as if it
+            # was one; the XML parser reads bytes natively.
+            xml_stream = BytesIO(marc.encode('utf-8'))
             xml_record = pymarc.parse_xml_to_array(xml_stream)[0]
             xml_stream.close()
 
@@ -563,7 +1009,8 @@ class Volume(object):
         tokencolname = 'token' if case else 'lowercase'
         tl = self.tokenlist(case=case, page_select=page_select).reset_index()
         if min_count > 1:
-            matches = tl.groupby(tokencolname)['count'].transform('sum').ge(min_count)
+            matches = tl.groupby(tokencolname, sort=False, observed=True)['count']\
+                        .transform('sum').ge(min_count)
             tl = tl[matches]
         return set(tl[tokencolname])
 
@@ -572,6 +1019,7 @@ class Volume(object):
             This is mostly a convenience these days - logic exists in
             the Volume class.
         '''
+        kwargs.setdefault('default_section', self.default_page_section)
         for seq in self.parser.seqs:
             yield Page(seq, self, **kwargs)
 
@@ -582,7 +1030,8 @@ class Volume(object):
         try:
             tokencounts = self.section_features(feature='tokenCount')
         except MissingDataError:
-            tokencounts = self.tokenlist(pos=False, case=False).groupby(level=self._pagecolname).sum()['count']
+            tokencounts = self.tokenlist(pos=False, case=False)\
+                              .groupby(level=self._pagecolname)['count'].sum()
         return tokencounts
 
     def line_counts(self, **kwargs):
@@ -698,40 +1147,130 @@ class Volume(object):
                                         "enough information for the current args. Missing "
                                         "column: %s" % column)
         
+        # Grouped tokenlists are cached by their folding arguments. Single
+        # pages are sliced from the tokenlist for the whole volume, so that
+        # iterating over Pages only groups the volume once.
+        cache_key = (pages, section, case, pos, page_freq, drop_section)
+        if cache_key not in self._tokencount_cache:
+            df = group_tokenlist(self._tokencounts, pages=pages, section=section,
+                                 case=case, pos=pos, page_freq=page_freq,
+                                 pagecolname=self._pagecolname,
+                                 codes_cache=self._codes_cache)
+
+            if drop_section:
+                df = df.droplevel('section')
+            self._tokencount_cache[cache_key] = df
+        df = self._tokencount_cache[cache_key]
+
         if page_select:
             try:
-                df = self._tokencounts.xs(page_select,
-                                          level=self._pagecolname, drop_level=False)
+                df = _page_rows(df, page_select, level=self._pagecolname,
+                                bounds_cache=self._page_bounds['tokenlist'].setdefault(cache_key, {}))
             except KeyError:
-                # Empty tokenlist
-                return self._tokencounts.iloc[0:0]
-        else:
-            df = self._tokencounts
+                try:
+                    _page_rows(self._tokencounts, page_select, level=self._pagecolname,
+                               bounds_cache=self._page_bounds['tokens'])
+                except KeyError:
+                    # Empty tokenlist
+                    return self._tokencounts.iloc[0:0]
+                # The page has tokens, but none in this selection
+                df = df.iloc[0:0]
+
+        # Copy, so that changes to the returned frame don't leak into the cache
+        df = df.copy()
 
-        df = group_tokenlist(df, pages=pages, section=section,
-                               case=case, pos=pos, page_freq=page_freq, pagecolname=self._pagecolname)
-        
-        if drop_section:
-            df = df.droplevel('section')
-        
         if htid:
-            # Prepent level with htid
-            df = pd.concat([df], keys=[self.id], names=['htid'])
+            # Prepend a single-valued htid level, reusing the existing levels
+            # and codes rather than concatenating a copy of the frame
+            index = df.index
+            if isinstance(index, pd.MultiIndex):
+                levels, codes = list(index.levels), list(index.codes)
+            else:
+                level_codes, level = pd.factorize(index)
+                levels, codes = [level], [level_codes]
+            df.index = pd.MultiIndex(levels=[pd.Index([self.id])] + levels,
+                                     codes=[np.zeros(len(df), dtype=np.int8)] + codes,
+                                     names=['htid'] + list(index.names),
+                                     verify_integrity=False)
         
         return df
 
-    def term_page_freqs(self, page_freq=True, case=True):
+    def tokenlist_arrow(self, **kwargs):
+        '''
+        Return tokenlist() as a pyarrow Table, with a column for each index
+        level and one for 'count'. Takes the same arguments as tokenlist().
+        Requires pyarrow.
+
+        String levels become dictionary-encoded columns, built from the
+        codes of the index: only the distinct values are converted, and the
+        codes and counts are handed to Arrow as they are.
+        '''
+        if pa is None:
+            raise ImportError("tokenlist_arrow requires pyarrow")
+        df = self.tokenlist(**kwargs)
+        index = df.index
+        if isinstance(index, pd.MultiIndex):
+            levels, codes = index.levels, index.codes
+        else:
+            level_codes, level = pd.factorize(index)
+            levels, codes = [pd.Index(level)], [level_codes]
+
+        columns = []
+        for level, level_codes in zip(levels, codes):
+            level_codes = np.asarray(level_codes)
+            indices = pa.array(level_codes.astype(np.int32), mask=level_codes < 0)
+            if level.dtype == object:
+                columns.append(pa.DictionaryArray.from_arrays(indices, pa.array(level.to_numpy())))
+            else:
+                columns.append(pa.array(level.to_numpy()).take(indices))
+        columns.append(pa.array(df['count'].to_numpy()))
+        return pa.Table.from_arrays(columns, names=list(index.names) + ['count'])
+
+    def term_page_freqs(self, page_freq=True, case=True, sparse=False):
         ''' Return a term frequency x page matrix, or optionally a
-        page frequency x page matrix '''
+        page frequency x page matrix.
+
+        sparse[bool]: Return a DataFrame backed by a scipy.sparse matrix,
+            with zeros for missing terms. Requires scipy. Values are float64,
+            as in the dense frame.
+        '''
         all_page_dfs = self.tokenlist(page_freq=page_freq, case=case, pos=False)
         tokencolname = 'token' if case else 'lowercase'
-        
-        return all_page_dfs.reset_index()\
-                           .groupby([tokencolname, self._pagecolname], as_index=False).sum()\
-                           .pivot(index=self._pagecolname, columns=tokencolname,
-                                  values='count')\
-                           .fillna(0)
-                           
+
+        if all_page_dfs.empty or not isinstance(all_page_dfs.index, pd.MultiIndex):
+            return all_page_dfs.reset_index()\
+                               .groupby([tokencolname, self._pagecolname], as_index=False,
+                                        sort=False, observed=True)['count'].sum()\
+                               .pivot(index=self._pagecolname, columns=tokencolname,
+                                      values='count')\
+                               .fillna(0)
+
+        # Place counts directly by the (sorted) page and token codes of the
+        # tokenlist index, rather than grouping and pivoting.
+        index = all_page_dfs.index
+        page_i = index.names.index(self._pagecolname)
+        token_i = index.names.index(tokencolname)
+        pages = index.levels[page_i].rename(self._pagecolname)
+        tokens = index.levels[token_i].rename(tokencolname)
+        page_codes, token_codes = index.codes[page_i], index.codes[token_i]
+        counts = all_page_dfs['count'].to_numpy()
+
+        if sparse:
+            try:
+                import scipy.sparse
+            except ImportError:
+                raise ImportError("term_page_freqs(sparse=True) requires scipy")
+            # Duplicate (page, token) pairs, e.g. from several sections, are
+            # summed by the conversion to CSR.
+            mat = scipy.sparse.coo_matrix((counts.astype(np.float64),
+                                           (page_codes, token_codes)),
+                                          shape=(len(pages), len(tokens))).tocsr()
+            return pd.DataFrame.sparse.from_spmatrix(mat, index=pages, columns=tokens)
+
+        matrix = np.zeros((len(pages), len(tokens)), dtype=np.float64)
+        np.add.at(matrix, (page_codes, token_codes), counts)
+        return pd.DataFrame(matrix, index=pages, columns=tokens)
+
     def _chunked_tokenlist(self, chunk_target = 10000, overflow_strategy = "ends", page_ref=False, **kwargs):
         '''
         Return a tokenlist dataframe grouped by numbered 'chunks', each of which has roughly `chunk_target` words.
@@ -740,42 +1279,76 @@ class Volume(object):
         - also takes tokenlist() arguments, such as case, drop_section, pos
 
         '''
+        try:
+            chunking_method = CHUNK_METHODS[overflow_strategy]
+        except KeyError:
+            raise ValueError("overflow_strategy must be one of {}".format(
+                ", ".join(CHUNK_METHODS)))
+
         # Chunking won't work with pages=False
         kwargs['pages'] = True
         tl = self.tokenlist(**kwargs)
-        newindex = ['chunk'] + [v for v in tl.index.names if v != 'page']
-        
-        with_chunks = tl.reset_index().set_index("page")
-        pagecounts = with_chunks.groupby('page')['count'].sum()
-
-        assert overflow_strategy in ["ends", "even", "last"]
-        chunking_method = getattr(transformations, "chunk_{}".format(overflow_strategy))
-        chunk_labs = chunking_method(pagecounts.values, chunk_target)
-
-        indexed = pd.Series(chunk_labs, index = pagecounts.index, name='chunk')
-        with_chunks = with_chunks.join(indexed) 
-        
-
         groups = [g for g in tl.index.names if g != 'page']
-        return_val = with_chunks.groupby(groups + ['chunk'])['count'].sum().reset_index()
 
-        if page_ref:
-            chunk_bounds = with_chunks.reset_index().groupby("chunk")['page']\
-               .agg(['min', 'max'])\
-               .rename(columns = {'min':'pstart', 'max':'pend'})
-               
-            return_val = return_val.set_index('chunk').join(chunk_bounds).reset_index()
-            newindex = ['chunk', 'pstart', 'pend'] + newindex[1:]
+        # Total words per page, in page order. The rows aren't necessarily
+        # sorted by page (e.g. a parquet file written elsewhere), so order
+        # the pages present by their level values.
+        if 'page' not in tl.index.names:
+            raise KeyError('page')
+        i = tl.index.names.index('page')
+        page_level = tl.index.levels[i]
+        page_codes = np.asarray(tl.index.codes[i], dtype=np.int64)
+        counts = tl['count'].to_numpy()
+        code_present = np.bincount(page_codes, minlength=len(page_level)) > 0
+        code_order = np.flatnonzero(code_present)
+        code_order = code_order[np.argsort(page_level.take(code_order), kind='stable')]
+        pagecounts = np.bincount(page_codes, weights=counts,
+                                 minlength=len(page_level))[code_order].astype(np.int64)
+
+        chunk_labs = chunking_method(pagecounts, chunk_target)
+
+        # Label each row with its page's chunk, through the page codes, and
+        # sum over the pages of each chunk.
+        chunks, page_chunk = np.unique(chunk_labs, return_inverse=True)
+        chunk_of_code = np.empty(len(tl.index.levels[i]), dtype=np.int64)
+        chunk_of_code[code_order] = page_chunk
+        keep = [j for j in range(tl.index.nlevels) if j != i]
+        index = pd.MultiIndex(levels=[pd.Index(chunks, name='chunk')] +
+                                     [tl.index.levels[j] for j in keep],
+                              codes=[chunk_of_code[page_codes]] +
+                                    [tl.index.codes[j] for j in keep],
+                              names=['chunk'] + groups, verify_integrity=False)
+        return_val = _sum_counts(pd.DataFrame({'count': counts}, index=index),
+                                 ['chunk'] + groups)
 
-        return return_val.set_index(newindex).sort_index()
+        if page_ref:
+            # Chunk labels were assigned over the pages sorted by number (see
+            # code_order above), so each chunk's pages are a contiguous run
+            # of that order and its bounds are a reduceat over the runs.
+            pages = page_level.take(code_order).to_numpy()
+            run_starts = np.flatnonzero(np.diff(page_chunk, prepend=-1))
+            chunk_bounds = [np.minimum.reduceat(pages, run_starts),
+                            np.maximum.reduceat(pages, run_starts)]
+            row_chunks = return_val.index.codes[0]
+            bound_levels, bound_codes = [], []
+            for bounds in chunk_bounds:
+                level_codes, level = pd.factorize(bounds, sort=True)
+                bound_levels.append(pd.Index(level))
+                bound_codes.append(level_codes[row_chunks])
+            index = return_val.index
+            return_val.index = pd.MultiIndex(
+                levels=index.levels[:1] + bound_levels + index.levels[1:],
+                codes=index.codes[:1] + bound_codes + index.codes[1:],
+                names=['chunk', 'pstart', 'pend'] + groups, verify_integrity=False)
+
+        return return_val
 
     def term_volume_freqs(self, page_freq=True, pos=True, case=True):
         ''' Return a list of each term's frequency in the entire volume '''
         df = self.tokenlist(page_freq=page_freq, pos=pos, case=case)
         tokencolname = 'token' if case else 'lowercase'
         groups = [tokencolname] if not pos else [tokencolname, 'pos']
-        return df.reset_index().drop([self._pagecolname], axis=1)\
-                 .groupby(groups, as_index=False).sum()\
+        return _sum_counts(df, groups).reset_index()\
                  .sort_values(by='count', ascending=False)
 
     def end_line_chars(self, **args):
@@ -801,19 +1374,31 @@ class Volume(object):
         if self._line_chars.empty:
             self._line_chars = self.parser._make_line_char_df()
         
-        df = self._line_chars
-        if page_select:
-            try:
-                df = df.xs(page_select, level='page',
-                                         drop_level=False)
-            except KeyError:
-                # Empty tokenlist
-                return self._line_chars.iloc[0:0]
-            
         if section == 'default':
             section = self.default_page_section
 
-        return group_linechars(df, section=section, place=place)
+        # As with tokenlist, single pages are sliced from the cached
+        # selection for the whole volume
+        key = ('line_chars', section, place)
+        if key not in self._feature_cache:
+            self._feature_cache[key] = group_linechars(self._line_chars, section=section,
+                                                       place=place)
+        df = self._feature_cache[key]
+
+        if page_select:
+            try:
+                df = _page_rows(df, page_select,
+                                bounds_cache=self._page_bounds['line_char_groups'].setdefault(key, {}))
+            except KeyError:
+                try:
+                    _page_rows(self._line_chars, page_select,
+                               bounds_cache=self._page_bounds['line_chars'])
+                except KeyError:
+                    # Empty tokenlist
+                    return self._line_chars.iloc[0:0]
+                # The page has characters, but none in this selection
+                df = df.iloc[0:0]
+        return df.copy()
     
     def save(self, dir, format = 'parquet', token_kwargs="default", **kwargs):
         '''
@@ -852,13 +1437,20 @@ class Volume(object):
                 return s[:maxlen].strip() + "..."
             else:
                 return s.strip()
-        if len(self.author) > 0:
-            return "<Volume: %s (%s) by %s>" % (truncate(self.title, 30), self.year, truncate(self.author[0], 40))
+        # author is rebuilt from the metadata on each access
+        author = self.author
+        if author:
+            return "<Volume: %s (%s) by %s>" % (truncate(self.title, 30), self.year, truncate(author[0], 40))
         else:
             return "<Volume: %s (%s) without a listed author>" % (truncate(self.title, 30), self.year)
 
+PAGE_SECTIONS = frozenset(SECREF + ['all', 'group'])
+
 class Page:
 
+    # Volumes create one Page per page, so skip the per-instance dict
+    __slots__ = ('default_section', 'volume', 'seq')
+
     BASIC_FIELDS = [('seq', 'seq'), ('tokenCount', '_token_count'),
                     ('languages', 'languages')]
     ''' List of fields which return primitive values in the schema, as tuples
@@ -870,19 +1462,26 @@ class Page:
     def __init__(self, seq, volume, default_section='body'):
         self.default_section = default_section
         self.volume = volume
-        self.seq = int(seq)
+        self.seq = seq if type(seq) is int else int(seq)
 
-        assert(self.default_section in SECREF + ['all', 'group'])
+        assert(self.default_section in PAGE_SECTIONS)
 
     def tokens(self, **kwargs):
         ''' Get unique tokens. Use args from Volume. '''
         return self.volume.tokens(page_select=self.seq, **kwargs)
 
+    def _section_feature(self, feature, section='default'):
+        ''' This page's value for a section feature. section='all' combines
+        the page's sections. '''
+        if section == 'default':
+            section = self.default_section
+        return self.volume._section_feature_at(feature, self.seq, section=section)
+
     def line_count(self, section='default'):
-        return self.volume.section_features(page_select=self.seq, feature='lineCount').values[0]
+        return self._section_feature('lineCount', section)
 
     def empty_line_count(self, section='default'):
-        return self.volume.section_features(page_select=self.seq, feature='emptyLineCount').values[0]
+        return self._section_feature('emptyLineCount', section)
 
     def cap_alpha_seq(self, section='body'):
         ''' Return the longest length of consecutive capital letters starting a
@@ -892,10 +1491,10 @@ class Page:
         if section != 'body':
             logging.warning("cap_alpha_seq only includes counts for the body "
                          "section of pages.")
-        return self.volume.cap_alpha_seqs(page_select=self.seq).values[0]
+        return self._section_feature('capAlphaSeq')
 
     def sentence_count(self, section='default'):
-        return self.volume.sentence_counts(page_select=self.seq).values[0]
+        return self._section_feature('sentenceCount', section)
 
     def tokenlist(self, **kwargs):
         '''
@@ -916,9 +1515,30 @@ class Page:
         '''
         return self.volume.line_chars(page_select=self.seq, **kwargs)
 
-    def token_count(self, **kwargs):
-        ''' Count total tokens on the page '''
-        return self.volume.section_features(page_select=self.seq, feature='tokenCount', **kwargs).values[0]
+    def token_count(self, section='default'):
+        ''' Count total tokens on the page. section='all' gives the total
+        over all sections.
+
+        Without section features (e.g. a parquet volume saved with tokens
+        only), the page's tokenlist is summed instead, as in
+        Volume.tokens_per_page. If the tokens were also saved without
+        sections, only the total of what was saved is available, for the
+        default section or 'all'.
+        '''
+        requested = section
+        if section == 'default':
+            section = self.default_section
+        try:
+            return self.volume._section_feature_at('tokenCount', self.seq, section=section)
+        except MissingDataError:
+            pass
+        try:
+            return self.tokenlist(section='group' if section == 'all' else section,
+                                  pos=False, case=False)['count'].sum()
+        except MissingFieldError:
+            if requested not in ('default', 'all', 'group'):
+                raise
+            return self.tokenlist(pos=False, case=False)['count'].sum()
 
     def __str__(self):
         if self.volume:
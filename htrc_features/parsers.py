@@ -4,8 +4,6 @@ import warnings
 import logging
 import pandas as pd
 import numpy as np
-import pymarc
-from six import iteritems, StringIO, BytesIO
 import codecs
 import os
 import types
@@ -16,6 +14,27 @@ try:
 except ImportError:
     import json
 
+try:
+    # orjson decodes several times faster than rapidjson, straight from
+    # bytes. It has no dumps(sort_keys=...), so it is only used to read.
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Default codec for writing parquet. zstd files are about a fifth smaller
+# than snappy ones, and no slower to read.
+if pq is not None and pa.Codec.is_available('zstd'):
+    PARQUET_COMPRESSION = 'zstd'
+else:
+    PARQUET_COMPRESSION = 'snappy'
+
 import requests
 
 from . import utils, resolvers
@@ -294,9 +313,7 @@ class JsonFileHandler(BaseFileHandler):
             if "object" in kwargs and kwargs['object'] == False:
                 return rawjson
 
-            if isinstance(rawjson, BytesIO):
-                rawjson = rawjson.decode()
-            return json.loads(rawjson)
+            return json_loads(rawjson)
     
     def _parse_meta(self):
         pass
@@ -317,26 +334,36 @@ class JsonFileHandler(BaseFileHandler):
         # saves a DF to self.section_features where the index is
         # (seq, section) and the columns are the values of
         # section_feature_list
-        collector = []
+        # Collect each feature as a column, rather than a dict per row
+        seqs, sections = [], []
+        columns = {feat: [] for feat in self.SECTION_FIELDS}
         for page in self._pages:
+            seq = int(page['seq'])
             for sec in SECREF:
-                if page[sec] is None:
+                sec_json = page[sec]
+                if sec_json is None:
                     continue
-                row = { feat: page[sec][feat] 
-                       for feat in self.SECTION_FIELDS }
-                row['page'] = int(page['seq'])
-                row['section'] = sec
-                collector.append(row)
-        return pd.DataFrame(collector).set_index(['page', 'section'])
+                seqs.append(seq)
+                sections.append(sec)
+                for feat, values in columns.items():
+                    values.append(sec_json[feat])
+        index = pd.MultiIndex.from_arrays([seqs, sections],
+                                          names=['page', 'section'])
+        return pd.DataFrame(columns, index=index)
     
     @property
     def token_freqs(self):
         ''' Returns a dataframe of page / section /count '''
         if not hasattr(self, "_token_freqs"):
-            d = [{'page': int(page['seq']), 'section': sec,
-                 'count':page[sec]['tokenCount']} for page 
-                 in self._pages for sec in SECREF]
-            self._token_freqs = pd.DataFrame(d).set_index(['page', 'section']).sort_index()
+            seqs, counts = [], []
+            for page in self._pages:
+                seq = int(page['seq'])
+                for sec in SECREF:
+                    seqs.append(seq)
+                    counts.append(page[sec]['tokenCount'])
+            index = pd.MultiIndex.from_arrays([seqs, SECREF * len(self._pages)],
+                                              names=['page', 'section'])
+            self._token_freqs = pd.DataFrame({'count': counts}, index=index).sort_index()
         return self._token_freqs
         
     def _make_tokencount_df(self, pages=False):
@@ -351,35 +378,40 @@ class JsonFileHandler(BaseFileHandler):
 
         tname = 'tokenPosCount'
 
-        # Make structured numpy array
-        # Because it is typed, this approach is ~40x faster than earlier
-        # methods
-        m = sum([page['tokenCount'] for page in pages])
-        arr = np.zeros(m, dtype=[(str('page'), str('u8')),
-                                 (str('section'), str('U6')),
-                                 (str('token'), str('U64')),
-                                 (str('pos'), str('U6')),
-                                 (str('count'), str('u4'))])
-        i = 0
+        # Collect each column in a flat list, in one pass over the JSON.
+        # Page and section are recorded once per section, with the number
+        # of rows it holds, and expanded with np.repeat.
+        seqs, sections, lengths = [], [], []
+        tokens, poses, counts = [], [], []
         for page in pages:
-            for sec in ['header', 'body', 'footer']:
+            seq = int(page['seq'])
+            for sec in SECREF:
                 if page[sec] is None:
                     continue
-                for token, posvalues in iteritems(page[sec][tname]):
-                    for pos, value in iteritems(posvalues):
-                        arr[i] = (page['seq'], sec, token, pos, value)
-                        i += 1
-                        if (i > m+1):
-                            logging.error("This volume has more token info "
-                                          "than the internal representation "
-                                          "allows. Email organisciak@gmail.com"
-                                          "to let the library author know!")
-
-        # Create a DataFrame
-        df = pd.DataFrame(arr[:i]).set_index(['page', 'section',
-                                              'token', 'pos'])
-        df.sort_index(inplace=True, level=0, sort_remaining=True)
-        return df
+                n = len(tokens)
+                sec_tokens = page[sec][tname]
+                for token, posvalues in sec_tokens.items():
+                    tokens.extend([token] * len(posvalues))
+                    poses.extend(posvalues.keys())
+                    counts.extend(posvalues.values())
+                if len(tokens) > n:
+                    seqs.append(seq)
+                    sections.append(sec)
+                    lengths.append(len(tokens) - n)
+
+        columns = [np.repeat(np.array(seqs, dtype=np.uint64), lengths),
+                   np.repeat(np.array(sections, dtype=object), lengths),
+                   np.array(tokens, dtype=object),
+                   np.array(poses, dtype=object)]
+
+        # Build the index once, from sorted factorizations of each column
+        codes, levels = zip(*[pd.factorize(col, sort=True) for col in columns])
+        order = np.lexsort(codes[::-1])
+        index = pd.MultiIndex(levels=levels, codes=[c[order] for c in codes],
+                              names=['page', 'section', 'token', 'pos'],
+                              verify_integrity=False)
+        counts = np.array(counts, dtype=np.uint32)[order]
+        return pd.DataFrame({'count': counts}, index=index)
             
     def _make_line_char_df(self, pages=False):
         '''
@@ -401,33 +433,112 @@ class JsonFileHandler(BaseFileHandler):
         else:
             place_key = [('begin', 'beginLineChars'), ('end', 'endLineChars')]
         
-        # Make structured numpy array
-        # Because it is typed, this approach is ~40x faster than earlier
-        # methods
-        m = len(pages) * 3 * 2  # Pages * section types * places
-        arr = np.zeros(int(m*100), dtype=[(str('page'), str('u8')),
-                                          (str('section'), str('U6')),
-                                          (str('place'), str('U5')),
-                                          (str('char'), str('U1')),
-                                          (str('count'), str('u8'))])
-        i = 0
+        # Collect each column in a flat list, as in _make_tokencount_df.
+        # Page, section and place are recorded once per set of chars, with
+        # the number of rows it holds, and expanded with np.repeat.
+        seqs, sections, places, lengths = [], [], [], []
+        chars, counts = [], []
         for page in pages:
-            for sec in ['header', 'body', 'footer']:
+            seq = int(page['seq'])
+            for sec in SECREF:
                 if page[sec] is None:
-                        continue
+                    continue
                 for place, json_key in place_key:
-                    if page[sec][json_key] is None:
+                    sec_chars = page[sec][json_key]
+                    if not sec_chars:
                         continue
-                    for char, value in iteritems(page[sec][json_key]):
-                        arr[i] = (page['seq'], sec, place, char, value)
-                        i += 1
-
-        # Create a DataFrame
-        df = pd.DataFrame(arr[:i]).set_index(['page', 'section',
-                                              'place', 'char'])
-        df.sort_index(0, inplace=True)
-        return df
+                    chars.extend(sec_chars.keys())
+                    counts.extend(sec_chars.values())
+                    seqs.append(seq)
+                    sections.append(sec)
+                    places.append(place)
+                    lengths.append(len(sec_chars))
+
+        columns = [np.repeat(np.array(seqs, dtype=np.uint64), lengths),
+                   np.repeat(np.array(sections, dtype=object), lengths),
+                   np.repeat(np.array(places, dtype=object), lengths),
+                   np.array(chars, dtype=object)]
+
+        codes, levels = zip(*[pd.factorize(col, sort=True) for col in columns])
+        order = np.lexsort(codes[::-1])
+        index = pd.MultiIndex(levels=levels, codes=[c[order] for c in codes],
+                              names=['page', 'section', 'place', 'char'],
+                              verify_integrity=False)
+        counts = np.array(counts, dtype=np.uint32)[order]
+        return pd.DataFrame({'count': counts}, index=index)
+
+
+def _uint32_counts(df):
+    '''
+    Store the 'count' column as uint32, matching the JSON parser, when the
+    stored values fit.
+    '''
+    if 'count' in df.columns and df['count'].dtype.kind in 'iu' and len(df):
+        if df['count'].min() >= 0 and df['count'].max() < 2**32:
+            df['count'] = df['count'].astype(np.uint32)
+    return df
 
+def _read_parquet(fin, index_cols=()):
+    '''
+    Read a parquet file into a DataFrame, indexed by its pandas index columns,
+    or by those of `index_cols` stored as plain columns.
+    '''
+    if pq is not None:
+        df = _read_parquet_arrow(fin, index_cols)
+        if df is not None:
+            return df
+        fin.seek(0)
+    df = pd.read_parquet(fin)
+    indcols = [col for col in index_cols if col in df.columns]
+    return df.set_index(indcols) if len(indcols) else df
+
+def _read_parquet_arrow(fin, index_cols=()):
+    '''
+    Read string columns dictionary-encoded, and build the sorted MultiIndex
+    directly from the dictionary codes rather than hashing every string again
+    in pandas. Returns None if an index column has missing values.
+    '''
+    schema = pq.read_schema(fin)
+    fin.seek(0)
+    pandas_meta = {}
+    if schema.metadata and b'pandas' in schema.metadata:
+        pandas_meta = json_loads(schema.metadata[b'pandas'])
+    stored_index = pandas_meta.get('index_columns', [])
+    names = [col for col in stored_index if isinstance(col, str)]
+    indcols = [col for col in index_cols if col in schema.names and col not in names]
+    if len(indcols):
+        names = indcols
+    table = pq.read_table(fin, read_dictionary=names).unify_dictionaries()
+
+    levels, codes = [], []
+    for name in names:
+        col = table[name].combine_chunks()
+        if col.null_count:
+            return None
+        if pa.types.is_dictionary(col.type):
+            indices = col.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+            dictionary = col.dictionary
+            # Keep the used values only, in sorted order
+            used = np.bincount(indices, minlength=len(dictionary)) > 0
+            order = pc.array_sort_indices(dictionary).to_numpy()
+            order = order[used[order]]
+            rank = np.full(len(dictionary), -1, dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            level = dictionary.take(pa.array(order)).to_numpy(zero_copy_only=False)
+            level_codes = rank[indices]
+        else:
+            level_codes, level = pd.factorize(col.to_numpy(zero_copy_only=False), sort=True)
+        levels.append(pd.Index(level, name=name))
+        codes.append(level_codes)
+
+    values = [col for col in table.column_names if col not in names and col not in stored_index]
+    df = pa.Table.from_arrays([table[col] for col in values], names=values).to_pandas()
+    if len(names) == 1:
+        df.index = levels[0].take(codes[0])
+    elif len(names):
+        df.index = pd.MultiIndex(levels=levels, codes=codes, names=names,
+                                 verify_integrity=False)
+    return df
 
 class ParquetFileHandler(BaseFileHandler):
     '''
@@ -449,7 +560,7 @@ class ParquetFileHandler(BaseFileHandler):
     '''
         
     
-    def __init__(self, id, id_resolver, mode = 'rb', compression = 'snappy', **kwargs):
+    def __init__(self, id, id_resolver, mode = 'rb', compression = PARQUET_COMPRESSION, **kwargs):
 
         self.format = "parquet"
 
@@ -460,7 +571,7 @@ class ParquetFileHandler(BaseFileHandler):
         
         try:
             with self.id_resolver.open(self.id, suffix = "meta", format = "json", compression = None) as meta_buffer:
-                self.meta = json.loads(meta_buffer.read().decode("utf-8"))
+                self.meta = json_loads(meta_buffer.read())
         except:
             self.meta = dict(id=self.id, title=self.id)
             
@@ -560,27 +671,24 @@ class ParquetFileHandler(BaseFileHandler):
     def _make_tokencount_df(self):
         try:
             with self.id_resolver.open(id = self.id, suffix = 'tokens', format = 'parquet') as fin:
-                df = pd.read_parquet(fin)
+                df = _read_parquet(fin, ['page', 'section', 'token', 'lowercase', 'pos'])
         except IOError:
             raise MissingDataError("No token information available")
             
-        indcols = [col for col in ['page', 'section', 'token', 'lowercase', 'pos'] if col in df.columns]
-        if len(indcols):
-            df = df.set_index(indcols)
-        return df
+        return _uint32_counts(df)
     
     def _make_line_char_df(self):
         try:
             with self.id_resolver.open(id = self.id, suffix = 'chars', format = 'parquet') as fin:
-                df = pd.read_parquet(fin)
-                return df 
+                df = _read_parquet(fin)
         except IOError:
             raise MissingDataError("No line char information available")
+        return _uint32_counts(df)
         
     def _make_section_feature_df(self):
         try:
             with self.id_resolver.open(id = self.id, suffix = 'section', format = 'parquet') as fin:
-                df = pd.read_parquet(fin)
+                df = _read_parquet(fin)
             return df 
         except IOError:
             raise MissingDataError("No section information available")
@@ -10,9 +10,19 @@ import sys
 from pathlib import Path
 from .utils import _id_encode
 
+try:
+    import indexed_bzip2
+except ImportError:
+    indexed_bzip2 = None
+
 
 MINOR_VERSION = (sys.version_info[1])
 
+# Compressed size above which bz2 files are decompressed with indexed_bzip2,
+# if installed. Smaller files are a single 900k block, with nothing to
+# parallelize.
+BZ2_PARALLEL_MIN_SIZE = 1 << 20
+
 from urllib.request import urlopen as _urlopen
 from urllib.parse import urlparse as parse_url
 from urllib.error import HTTPError
@@ -73,6 +83,20 @@ class IdResolver():
             raise FileNotFoundError("Empty buffer found very late")            
         elif compression is None or format=="parquet":
             return buffer
+        elif mode == 'rb' and compression in ["bz2", "gz"]:
+            # Volume files are small, so decompressing in a single call is
+            # much faster than streaming through a BZ2File or GzipFile.
+            raw = buffer.read()
+            buffer.close()
+            if compression == "bz2" and indexed_bzip2 is not None \
+                    and len(raw) > BZ2_PARALLEL_MIN_SIZE:
+                # Large files hold several bz2 blocks, which indexed_bzip2
+                # decodes in parallel.
+                with indexed_bzip2.open(BytesIO(raw), parallelization=os.cpu_count()) as fin:
+                    return BytesIO(fin.read())
+            if compression == "bz2":
+                return BytesIO(bz2.decompress(raw))
+            return BytesIO(gzip.decompress(raw))
         elif compression == "bz2":
             return bz2.open(buffer, mode)
         elif compression == "gz":
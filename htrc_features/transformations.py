@@ -71,10 +71,14 @@ def _chunking_algorithm(page_counts, target, even = False, two_sided = True, pro
     # as the process continues, the page_counts object will be slowly trimmed.
     assert(target > 0)
 
+    # Signed counts, so distances from the target can't wrap around for
+    # unsigned inputs.
+    page_counts = np.asarray(page_counts, dtype=np.int64)
+
     # maintain pointers to navigate the array.
     position = [0, len(page_counts)]
 
-    breaks = np.zeros(page_counts.shape[0], np.int)
+    breaks = np.zeros(page_counts.shape[0], int)
     breaks[0] = 1
     
     loop = -1
@@ -6,6 +6,7 @@ import random
 import numpy as np
 from collections import Counter
 import pandas as pd
+import shutil
 
 class TestChunking():
 
@@ -26,6 +27,34 @@ class TestChunking():
         read = pd.read_parquet(Path(tmpdir, "foo.123.tokens.parquet")).reset_index()
         assert("chunk" in read.columns)
             
+    def test_chunking_unsorted_parquet(self, tmpdir):
+        # Parquet files written elsewhere needn't be sorted by page; chunks
+        # should still cover consecutive pages.
+        src = Path("tests/data/fullparquet")
+        for f in src.iterdir():
+            shutil.copy(str(f), str(tmpdir))
+        path = Path(tmpdir, "uc2.ark+=13960=t1xd0sc6x.tokens.parquet")
+        pd.read_parquet(path).sample(frac=1, random_state=1).to_parquet(path)
+
+        kwargs = dict(chunk=True, chunk_target=5000)
+        vol_id = 'uc2.ark:/13960/t1xd0sc6x'
+        ordered = Volume(id=vol_id, format='parquet', dir=str(src), id_resolver='local')
+        shuffled = Volume(id=vol_id, format='parquet', dir=str(tmpdir), id_resolver='local')
+        expected = ordered.tokenlist(**kwargs)
+        assert shuffled.tokenlist(**kwargs).sort_index().equals(expected.sort_index())
+
+        # Page bounds of each chunk
+        refs = shuffled.tokenlist(page_ref=True, **kwargs)
+        assert refs.sort_index().equals(
+            ordered.tokenlist(page_ref=True, **kwargs).sort_index())
+        refs = refs.reset_index()
+        bounds = refs.groupby('chunk')[['pstart', 'pend']].first()
+        pages = shuffled.tokenlist().reset_index()['page']
+        assert bounds['pstart'].iloc[0] == pages.min()
+        assert bounds['pend'].iloc[-1] == pages.max()
+        assert (bounds['pstart'].iloc[1:].values > bounds['pend'].iloc[:-1].values).all()
+        assert (bounds['pstart'] <= bounds['pend']).all()
+
     def test_even_chunking(self):
         # All methods should solve it when pages are only one thing long.
         for method in chunk_ends, chunk_even, chunk_last:
@@ -64,6 +93,30 @@ class TestChunking():
 
             assert(np.max([*c.values()]) <= 501)
 
+    def test_unsigned_page_counts(self):
+        # Page counts summed from uint32 token counts are unsigned; the
+        # distance to the target mustn't wrap around below zero.
+        test_counts = np.array([30] * 11)
+        target = 100
+        expected = chunk_last(test_counts, target)
+        c = Counter()
+        for chunk, count in zip(expected, test_counts):
+            c[chunk] += count
+        assert [c[k] for k in sorted(c)] == [90, 90, 90, 60]
+        for dtype in [np.uint32, np.uint64]:
+            for method in chunk_ends, chunk_even, chunk_last:
+                assert (method(test_counts.astype(dtype), target) ==
+                        method(test_counts, target)).all()
+
+        # Counts are uint32 whether a volume was read from JSON or parquet,
+        # for tokens and line chars alike.
+        json_vol = Volume('tests/data/green-gables-full.json.bz2')
+        parquet_vol = Volume(id='uc2.ark:/13960/t1xd0sc6x', format='parquet',
+                             dir='tests/data/fullparquet', id_resolver='local')
+        for vol in json_vol, parquet_vol:
+            assert vol.tokenlist()['count'].dtype == np.uint32
+            assert vol.line_chars()['count'].dtype == np.uint32
+
     def test_tiny_chunk_size(self):
         # What if the chunk size is much smaller than any page?
         # The only reasonable response is 
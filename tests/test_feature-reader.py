@@ -2,6 +2,7 @@ import pytest
 from htrc_features import FeatureReader
 import htrc_features
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 
 @pytest.fixture(scope="module")
@@ -20,6 +21,9 @@ def titles():
     return ['Anne of Green Gables / L.M. Montgomery.',
               'Frankenstein : or, The modern Prometheus.']
 
+def _title(vol):
+    return vol.title
+
 
 class TestFeatureReader():
 
@@ -37,6 +41,11 @@ class TestFeatureReader():
         for i, vol in enumerate(feature_reader):
             assert type(vol) == htrc_features.feature_reader.Volume
             assert vol.title == titles[i]
+
+    def test_tuple_load(self, paths, titles):
+        feature_reader = FeatureReader(tuple(paths))
+        assert len(feature_reader) == 2
+        assert [vol.title for vol in feature_reader] == titles
             
     def test_id_remote_load(self, ids):
         id = ids[0]
@@ -64,6 +73,16 @@ class TestFeatureReader():
             assert type(vol) == htrc_features.feature_reader.Volume
             assert vol.title == titles[i]
         
+    def test_parquet_token_count(self, ids, paths):
+        # The partial parquet files have no section features, so page token
+        # counts are summed from the tokenlist.
+        dirpath = os.path.join('tests', 'data', 'partialparq')
+        vol = FeatureReader(ids=ids, format='parquet', dir=dirpath).first()
+        json_vol = FeatureReader(paths).first()
+        for seq in [3, 53, 57]:
+            assert (htrc_features.Page(seq, vol).token_count() ==
+                    htrc_features.Page(seq, json_vol).token_count())
+
     def test_json_only_load(self, paths):
         path = paths[0]
         feature_reader = FeatureReader(path)
@@ -79,6 +98,59 @@ class TestFeatureReader():
         for vol in feature_reader.volumes():
             assert type(vol) == htrc_features.feature_reader.Volume
 
+    def test_prefetched_volumes(self, paths, titles, monkeypatch):
+        # Remote volumes are downloaded one ahead; exercise that path with
+        # local files.
+        feature_reader = FeatureReader(paths * 2)
+        monkeypatch.setattr(feature_reader, '_uses_http', lambda: True)
+        assert [vol.title for vol in feature_reader] == titles * 2
+        assert feature_reader.first().title == titles[0]
+
+    def test_parallel_volumes(self, paths, titles):
+        feature_reader = FeatureReader(paths)
+        vols = list(feature_reader.parallel_volumes(n_cpu=2))
+        assert [vol.title for vol in vols] == titles
+        for vol in vols:
+            assert type(vol) == htrc_features.feature_reader.Volume
+            assert not vol.tokenlist().empty
+
+    def test_parallel_tokenlists(self, paths):
+        feature_reader = FeatureReader(paths)
+        tls = list(feature_reader.parallel_tokenlists(n_cpu=2, chunk=True,
+                                                      chunk_target=500))
+        for vol, tl in zip(feature_reader.volumes(), tls):
+            assert tl.equals(vol.tokenlist(chunk=True, chunk_target=500))
+
+    def test_map(self, paths, titles):
+        feature_reader = FeatureReader(paths)
+        assert list(feature_reader.map(_title, n_cpu=2)) == titles
+
+    def test_map_window(self, paths, titles, monkeypatch):
+        # Only `window` chunks of ids are submitted ahead of the caller.
+        feature_reader = FeatureReader(paths * 3)
+        submitted = []
+
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, fn, ids, *args):
+                submitted.append(ids)
+                return super().submit(fn, ids, *args)
+
+        monkeypatch.setattr(feature_reader, '_executor',
+                            lambda n_cpu=None: CountingExecutor(n_cpu))
+        results = feature_reader.map(_title, n_cpu=2, chunksize=1, window=2)
+        assert next(results) == titles[0]
+        assert len(submitted) == 3
+        assert [titles[0]] + list(results) == titles * 3
+        assert len(submitted) == len(paths) * 3
+
+    def test_parallel_save(self, paths, ids, titles, tmpdir):
+        feature_reader = FeatureReader(paths)
+        feature_reader.parallel_save(str(tmpdir), n_cpu=2)
+        saved = FeatureReader(ids=ids, format='parquet', dir=str(tmpdir))
+        for i, vol in enumerate(saved):
+            assert vol.title == titles[i]
+            assert not vol.tokenlist().empty
+
     def test_first(self, paths, titles):
         feature_reader = FeatureReader(paths)
         vol = feature_reader.first()
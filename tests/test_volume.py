@@ -2,8 +2,10 @@ import pytest
 from htrc_features import FeatureReader, Volume, utils
 import os
 import json
+import shutil
 import htrc_features
 import pandas as pd
+import numpy as np
 
 
 # TestFeatureReader already tested loading, so we'll load a common volume
@@ -169,6 +171,62 @@ class TestVolume():
         assert(end_characters.loc[(3, 'body', 'end', '3'), ].values[0] == 1)
         assert(end_characters.groupby(level='char').sum().loc['.'].values[0] == 46)
 
+    def test_grouped_char_counts(self, volume):
+        grouped = volume.line_chars(section='group')
+        assert grouped.index.names == ['page', 'place', 'char']
+        expected = volume.line_chars(section='all').groupby(level=['page', 'place', 'char']).sum()
+        assert grouped['count'].to_dict() == expected['count'].to_dict()
+        assert grouped.loc[(3, 'begin', '/'), 'count'] == 1
+
+    def test_page_counts_all_sections(self, paths, volume):
+        # With every section kept, a page has a row per section; the page
+        # accessors combine them into the page's value.
+        vol = Volume(paths[0], compression=None, default_page_section='all')
+        page = next(p for p in vol.pages() if p.seq == 53)
+        counts = [page.line_count(), page.empty_line_count(),
+                  page.sentence_count(), page.cap_alpha_seq()]
+        # header + body + footer; capAlphaSeq is the longest run
+        assert counts == [39, 7, 23, 2]
+        for count in counts:
+            assert np.ndim(count) == 0
+
+        page = htrc_features.Page(53, volume)
+        assert page.line_count() == 36
+        assert page.line_count(section='all') == 39
+        assert page.line_count(section='header') == 3
+
+    def test_page_token_count_all_sections(self, volume):
+        page = htrc_features.Page(53, volume)
+        assert page.token_count() == 344
+        count = page.token_count(section='all')
+        assert np.ndim(count) == 0
+        # header 5 + body 344 + footer 0
+        assert count == 349
+        assert page.token_count(section='header') == 5
+
+    def test_page_token_count_without_section_features(self, tmpdir):
+        # Without a section features file, counts are summed from the
+        # tokenlist, and 'all' still gives the page total.
+        src = os.path.join('tests', 'data', 'fullparquet')
+        for name in os.listdir(src):
+            if '.section.' not in name:
+                shutil.copy(os.path.join(src, name), str(tmpdir))
+        vol = Volume(id='uc2.ark:/13960/t1xd0sc6x', format='parquet',
+                     dir=str(tmpdir), id_resolver='local')
+        page = htrc_features.Page(53, vol)
+        assert page.token_count() == 344
+        assert page.token_count(section='all') == 349
+        assert page.token_count(section='header') == 5
+
+        # Tokens saved without sections only have the saved total
+        vol = Volume(id='uc2.ark:/13960/t1xd0sc6x', format='parquet',
+                     dir=os.path.join('tests', 'data', 'partialparq'),
+                     id_resolver='local')
+        page = htrc_features.Page(53, vol)
+        assert page.token_count() == page.token_count(section='all') == 344
+        with pytest.raises(htrc_features.feature_reader.MissingFieldError):
+            page.token_count(section='header')
+
     def test_cap_alpha_seq(self, volume):
         assert sum(volume.cap_alpha_seqs()) == 35
 
@@ -220,6 +278,40 @@ class TestVolume():
                                pages=False)
         assert tl7.index.names == ['lowercase']
 
+    def test_page_freq_counts_pages(self, volume):
+        # When pos or case folding merge rows on a page, the page still
+        # counts once.
+        tl = volume.tokenlist(pos=False, case=False).reset_index()
+        n_pages = tl.groupby('lowercase')['page'].nunique()
+        freqs = volume.tokenlist(pages=False, page_freq=True, pos=False, case=False)
+        freqs = freqs.droplevel('section')
+        assert freqs['count'].to_dict() == n_pages.to_dict()
+        summed = volume.tokenlist(pages=False, pos=False, case=False)\
+                       .droplevel('section')['count']
+        assert (summed > freqs['count']).any()
+
+        page_freqs = volume.term_page_freqs(page_freq=True, case=False)
+        assert page_freqs.isin([0, 1]).all().all()
+        assert page_freqs.sum().to_dict() == n_pages.to_dict()
+
+    def test_sparse_term_page_freqs(self, volume):
+        pytest.importorskip("scipy")
+        for page_freq in [True, False]:
+            dense = volume.term_page_freqs(page_freq=page_freq)
+            sparse = volume.term_page_freqs(page_freq=page_freq, sparse=True)
+            assert (sparse.dtypes == pd.SparseDtype('float64', 0)).all()
+            pd.testing.assert_frame_equal(sparse.sparse.to_dense(), dense)
+
+    def test_tokenlist_arrow(self, volume):
+        pytest.importorskip("pyarrow")
+        for kwargs in [dict(), dict(section='group', pos=False, case=False, pages=False)]:
+            table = volume.tokenlist_arrow(**kwargs)
+            tl = volume.tokenlist(**kwargs).reset_index()
+            assert table.column_names == list(tl.columns)
+            df = table.to_pandas()
+            for col in tl.columns:
+                assert list(df[col]) == list(tl[col])
+
     def test_internal_tokencount_representation(self, paths):
         paths = paths[0]
         feature_reader = FeatureReader(paths, compression=None)